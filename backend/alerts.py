@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+import json
+import math
+import os
+import pathlib
+import statistics
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+# Metrics that can be referenced by alert rules
+ALERT_METRICS = (
+    "spread",
+    "mid_price",
+    "margin_ratio",
+    "liquidation_distance",
+    "volatility",
+    "staleness_ms",
+)
+ALERT_DIRECTIONS = ("above", "below")
+ALERT_HISTORY_SIZE = 500
+VOLATILITY_WINDOW_MS = 60000  # Mid price samples older than this are dropped
+VOLATILITY_MIN_SAMPLES = 3  # At least two returns are needed for a deviation
+
+# Alert rule model
+class AlertRule(BaseModel):
+    id: str
+    instrument: str
+    metric: str
+    direction: str = "above"  # "above" fires on value > threshold, "below" on value < threshold
+    threshold: float
+    hysteresis: float = 0.0  # distance back past the threshold required to re-arm
+    debounce_ms: int = 0  # how long the condition must hold before firing
+    message: Optional[str] = None
+
+# Alert event model
+class Alert(BaseModel):
+    rule_id: str
+    instrument: str
+    metric: str
+    direction: str
+    threshold: float
+    value: float
+    state: str  # "triggered" or "cleared"
+    timestamp: int
+    message: Optional[str] = None
+
+def validate_rule(rule: AlertRule):
+    if rule.metric not in ALERT_METRICS:
+        raise ValueError(f"Unknown metric '{rule.metric}', expected one of {', '.join(ALERT_METRICS)}")
+    if rule.direction not in ALERT_DIRECTIONS:
+        raise ValueError(f"Unknown direction '{rule.direction}', expected 'above' or 'below'")
+    if rule.hysteresis < 0:
+        raise ValueError("hysteresis must not be negative")
+    if rule.debounce_ms < 0:
+        raise ValueError("debounce_ms must not be negative")
+
+class RuleBucket:
+    """Compiled rules sharing one (instrument, metric, direction)
+
+    "below" rules are stored negated so both directions share the same
+    "signed value > level" test. Trigger and clear levels are kept as
+    sorted arrays, so a value move from prev to cur only visits the rules
+    whose level lies between the two, found by bisection.
+    """
+
+    def __init__(self, direction: str):
+        self.sign = 1.0 if direction == "above" else -1.0
+        self.rules: Dict[str, AlertRule] = {}
+        self.trigger_levels: List[float] = []
+        self.trigger_rules: List[AlertRule] = []
+        self.clear_levels: List[float] = []
+        self.clear_rules: List[AlertRule] = []
+        self.active = set()
+        self.pending: Dict[str, int] = {}
+        self.fresh = set()
+        self.last_value: Optional[float] = None
+
+    def compile(self):
+        by_trigger = sorted(self.rules.values(), key=lambda r: self.sign * r.threshold)
+        self.trigger_levels = [self.sign * r.threshold for r in by_trigger]
+        self.trigger_rules = by_trigger
+
+        by_clear = sorted(self.rules.values(), key=lambda r: self.sign * r.threshold - r.hysteresis)
+        self.clear_levels = [self.sign * r.threshold - r.hysteresis for r in by_clear]
+        self.clear_rules = by_clear
+
+        # Drop state belonging to rules that were removed
+        self.active &= set(self.rules)
+        self.fresh &= set(self.rules)
+        self.pending = {rule_id: ts for rule_id, ts in self.pending.items() if rule_id in self.rules}
+
+    def evaluate(self, value: float, now_ms: int) -> List[Tuple[AlertRule, str]]:
+        x = self.sign * value
+        prev = self.last_value
+        self.last_value = x
+
+        if x == prev and not self.pending and not self.fresh:
+            return []
+
+        events = []
+
+        # Rules whose trigger level was crossed on the way up become pending
+        if prev is None:
+            start, end = 0, bisect_left(self.trigger_levels, x)
+        elif x > prev:
+            start, end = bisect_left(self.trigger_levels, prev), bisect_left(self.trigger_levels, x)
+        else:
+            start = end = 0
+        for rule in self.trigger_rules[start:end]:
+            if rule.id not in self.active and rule.id not in self.pending:
+                self.pending[rule.id] = now_ms
+
+        # Rules added since the last tick have not seen the current value yet
+        for rule_id in self.fresh:
+            rule = self.rules[rule_id]
+            if x > self.sign * rule.threshold and rule_id not in self.active and rule_id not in self.pending:
+                self.pending[rule_id] = now_ms
+        self.fresh.clear()
+
+        # Active rules whose clear level was crossed on the way down re-arm
+        if prev is not None and x < prev:
+            start, end = bisect_right(self.clear_levels, x), bisect_right(self.clear_levels, prev)
+            for rule in self.clear_rules[start:end]:
+                if rule.id in self.active:
+                    self.active.discard(rule.id)
+                    events.append((rule, "cleared"))
+
+        # Pending rules fire once the condition has held for the debounce period
+        for rule_id, since in list(self.pending.items()):
+            rule = self.rules[rule_id]
+            if x <= self.sign * rule.threshold:
+                del self.pending[rule_id]
+            elif now_ms - since >= rule.debounce_ms:
+                del self.pending[rule_id]
+                self.active.add(rule_id)
+                events.append((rule, "triggered"))
+
+        return events
+
+class AlertEngine:
+    """Threshold rules indexed by instrument and metric
+
+    Evaluating a tick only touches the buckets of the instrument that
+    ticked, so rules on other instruments cost nothing.
+    """
+
+    def __init__(self):
+        self.rules: Dict[str, AlertRule] = {}
+        self.index: Dict[str, Dict[str, Dict[str, RuleBucket]]] = {}
+        self.history = deque(maxlen=ALERT_HISTORY_SIZE)
+
+    def instruments(self) -> List[str]:
+        return list(self.index.keys())
+
+    def _bucket(self, rule: AlertRule, create: bool = False) -> Optional[RuleBucket]:
+        metrics = self.index.get(rule.instrument)
+        if metrics is None:
+            if not create:
+                return None
+            metrics = self.index[rule.instrument] = {}
+        directions = metrics.get(rule.metric)
+        if directions is None:
+            if not create:
+                return None
+            directions = metrics[rule.metric] = {}
+        bucket = directions.get(rule.direction)
+        if bucket is None and create:
+            bucket = directions[rule.direction] = RuleBucket(rule.direction)
+        return bucket
+
+    def _detach(self, rule: AlertRule) -> RuleBucket:
+        bucket = self._bucket(rule)
+        del bucket.rules[rule.id]
+        return bucket
+
+    def _prune(self, rule: AlertRule):
+        # Remove empty buckets so instruments without rules are no longer polled
+        metrics = self.index[rule.instrument]
+        directions = metrics[rule.metric]
+        if not directions[rule.direction].rules:
+            del directions[rule.direction]
+        if not directions:
+            del metrics[rule.metric]
+        if not metrics:
+            del self.index[rule.instrument]
+
+    def _record(self, rule: AlertRule, value: float, state: str, now_ms: int) -> Alert:
+        alert = Alert(
+            rule_id=rule.id,
+            instrument=rule.instrument,
+            metric=rule.metric,
+            direction=rule.direction,
+            threshold=rule.threshold,
+            value=value,
+            state=state,
+            timestamp=now_ms,
+            message=rule.message
+        )
+        self.history.append(alert)
+        return alert
+
+    def _release(self, bucket: RuleBucket, rule: AlertRule, now_ms: int) -> List[Alert]:
+        # Forget a rule's state, clearing it for clients if it was triggered
+        bucket.fresh.discard(rule.id)
+        bucket.pending.pop(rule.id, None)
+        if rule.id not in bucket.active:
+            return []
+        bucket.active.discard(rule.id)
+        value = bucket.sign * bucket.last_value if bucket.last_value is not None else rule.threshold
+        return [self._record(rule, value, "cleared", now_ms)]
+
+    def add_rules(self, rules: List[AlertRule], now_ms: Optional[int] = None) -> List[Alert]:
+        """Add or replace rules, returning "cleared" alerts for replaced rules that were triggered"""
+        for rule in rules:
+            validate_rule(rule)
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+
+        cleared = []
+        touched = {}
+        for rule in rules:
+            old = self.rules.get(rule.id)
+            if old is not None:
+                bucket = self._detach(old)
+                cleared.extend(self._release(bucket, old, now_ms))
+                touched[id(bucket)] = (bucket, old)
+            bucket = self._bucket(rule, create=True)
+            bucket.rules[rule.id] = rule
+            bucket.fresh.add(rule.id)
+            touched[id(bucket)] = (bucket, rule)
+            self.rules[rule.id] = rule
+
+        # Recompile each touched bucket once, however many rules it received
+        for bucket, rule in touched.values():
+            bucket.compile()
+            if not bucket.rules:
+                self._prune(rule)
+
+        return cleared
+
+    def remove_rule(self, rule_id: str, now_ms: Optional[int] = None) -> Optional[List[Alert]]:
+        """Remove a rule, returning None if it is unknown, else any "cleared" alert for it"""
+        rule = self.rules.pop(rule_id, None)
+        if rule is None:
+            return None
+        if now_ms is None:
+            now_ms = int(time.time() * 1000)
+        bucket = self._detach(rule)
+        cleared = self._release(bucket, rule, now_ms)
+        bucket.compile()
+        if not bucket.rules:
+            self._prune(rule)
+        return cleared
+
+    def evaluate(self, instrument: str, metrics: Dict[str, Optional[float]], now_ms: int) -> List[Alert]:
+        indexed = self.index.get(instrument)
+        if not indexed:
+            return []
+
+        alerts = []
+        for metric, directions in indexed.items():
+            value = metrics.get(metric)
+            if value is None or value != value:  # Missing or NaN
+                continue
+            for bucket in directions.values():
+                for rule, state in bucket.evaluate(value, now_ms):
+                    alerts.append(self._record(rule, value, state, now_ms))
+        return alerts
+
+    def load_rules(self, path: pathlib.Path):
+        with open(path, "r") as f:
+            self.add_rules([AlertRule(**r) for r in json.load(f)])
+
+    def rules_snapshot(self) -> List[dict]:
+        return [r.dict() for r in self.rules.values()]
+
+def write_rules_file(path: pathlib.Path, rules: List[dict]):
+    # Write to a temp file first so a crash never leaves a truncated rules file
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(rules, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class AlertMetricsTracker:
+    """Per-instrument feed state used to assemble alert metrics on every pass
+
+    Book metrics are cached and only recomputed when the feed timestamps
+    move, and dropped while the book can't be read. Staleness, volatility
+    and the position/account metrics are derived on every pass so they
+    track the clock and the current positions even while the book is
+    quiet or unreadable.
+    """
+
+    def __init__(self, volatility_window_ms: int = VOLATILITY_WINDOW_MS):
+        self.volatility_window_ms = volatility_window_ms
+        self.feed_timestamps: Dict[str, tuple] = {}  # Last (exchange_ts, local_ts) seen
+        self.feed_local_ts: Dict[str, int] = {}  # Last feed update time used for staleness
+        self.book_metrics: Dict[str, dict] = {}  # Book metrics from the last feed update
+        self.mid_price_history: Dict[str, deque] = {}  # (now_ms, mid_price) samples
+
+    def update(self, instrument: str, depth, now_ms: int, position=None,
+               account_margin_ratio: Optional[float] = None) -> Dict[str, Optional[float]]:
+        # Staleness counts from when we started watching until the first read
+        self.feed_local_ts.setdefault(instrument, now_ms)
+
+        if depth is None:
+            # Without a readable book there are no book metrics to evaluate
+            self.feed_timestamps.pop(instrument, None)
+            self.book_metrics.pop(instrument, None)
+        else:
+            feed_ts = (depth.timestamp, depth.local_timestamp)
+            if self.feed_timestamps.get(instrument) != feed_ts:
+                self.feed_timestamps[instrument] = feed_ts
+                self.feed_local_ts[instrument] = depth.local_timestamp
+                if depth.bids and depth.asks:
+                    best_bid = depth.bids[0]["price"]
+                    best_ask = depth.asks[0]["price"]
+                    self.book_metrics[instrument] = {
+                        "spread": best_ask - best_bid,
+                        "mid_price": (best_bid + best_ask) / 2,
+                    }
+                else:
+                    self.book_metrics.pop(instrument, None)
+
+        metrics = dict(self.book_metrics.get(instrument, {}))
+        mid_price = metrics.get("mid_price")
+        metrics["volatility"] = self._volatility(instrument, mid_price, now_ms)
+        metrics["staleness_ms"] = now_ms - self.feed_local_ts[instrument]
+
+        if account_margin_ratio is not None:
+            metrics["margin_ratio"] = account_margin_ratio
+
+        # An open position with a known liquidation price, measured from the current mid
+        if mid_price and position is not None and position.quantity and position.liquidation_price:
+            metrics["liquidation_distance"] = abs(mid_price - position.liquidation_price) / mid_price
+
+        return metrics
+
+    def _volatility(self, instrument: str, mid_price: Optional[float], now_ms: int) -> Optional[float]:
+        """Standard deviation of log mid returns per square root second
+
+        The mid price is sampled once per call, so on a fixed time grid
+        when called from the evaluation loop. Each return is scaled by the
+        square root of its sample gap, making the value independent of the
+        exact poll rate.
+        """
+        history = self.mid_price_history.setdefault(instrument, deque())
+        if mid_price and (not history or now_ms > history[-1][0]):
+            history.append((now_ms, mid_price))
+        while history and history[0][0] < now_ms - self.volatility_window_ms:
+            history.popleft()
+
+        if len(history) < VOLATILITY_MIN_SAMPLES:
+            return None
+        samples = list(history)
+        returns = [
+            math.log(price / prev_price) / math.sqrt((ts - prev_ts) / 1000.0)
+            for (prev_ts, prev_price), (ts, price) in zip(samples, samples[1:])
+        ]
+        return statistics.pstdev(returns)
+
+    def prune(self, instruments):
+        """Drop state for instruments that are no longer watched"""
+        watched = set(instruments)
+        for state in (self.feed_timestamps, self.feed_local_ts, self.book_metrics, self.mid_price_history):
+            for instrument in list(state):
+                if instrument not in watched:
+                    del state[instrument]
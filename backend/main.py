@@ -9,12 +9,16 @@ from ctypes import Structure, c_double, c_uint64, c_char, c_bool
 from typing import Dict, List, Optional
 from datetime import datetime
 import pathlib
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
+from alerts import AlertEngine, AlertMetricsTracker, AlertRule, write_rules_file
+
 # Define data structures (same as in simple_shm_reader.py)
 class PriceLevel(Structure):
     _fields_ = [
@@ -45,6 +49,10 @@ SHM_MOUNT_POINT = "/dev/shm"
 SHM_DIRECTORY = "okx_market_data"
 INSTRUMENT = "BTC-USDT"  # Default instrument
 
+# Alerting configuration
+ALERT_EVAL_INTERVAL = 0.2  # Seconds between rule evaluations
+ALERT_WEBHOOK_QUEUE_SIZE = 1000  # Pending webhook posts before new alerts are dropped
+
 # Position tracking model
 class Position(BaseModel):
     instrument: str
@@ -73,6 +81,7 @@ class RiskMetrics(BaseModel):
 class MarketDepth(BaseModel):
     instrument: str
     timestamp: int
+    local_timestamp: int = 0
     bids: List[Dict[str, float]]
     asks: List[Dict[str, float]]
 
@@ -93,11 +102,19 @@ class ConnectionManager:
         self.active_connections.append(websocket)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
 
     async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        connections = list(self.active_connections)
+        results = await asyncio.gather(
+            *(connection.send_text(message) for connection in connections),
+            return_exceptions=True
+        )
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                print(f"Error broadcasting to websocket, dropping connection: {result}")
+                self.disconnect(connection)
 
 app = FastAPI(title="Crypto Trading Panel API")
 
@@ -143,11 +160,13 @@ risk_metrics = RiskMetrics(
 
 # API key configuration - load from config file
 CONFIG_FILE = pathlib.Path(__file__).parent / "config.json"
+ALERT_RULES_FILE = pathlib.Path(__file__).parent / "alert_rules.json"
 API_CONFIG = {
     "api_key": "",
     "api_secret": "",
     "passphrase": ""
 }
+ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL", "")
 
 def has_valid_api_credentials():
     """Check if valid API credentials are configured"""
@@ -164,6 +183,8 @@ try:
                 API_CONFIG["api_secret"] = config_data["api_secret"]
             if "passphrase" in config_data:
                 API_CONFIG["passphrase"] = config_data["passphrase"]
+            if config_data.get("alert_webhook_url"):
+                ALERT_WEBHOOK_URL = config_data["alert_webhook_url"]
         print("Loaded API configuration from config.json")
     else:
         print("Config file not found at:", CONFIG_FILE)
@@ -183,6 +204,20 @@ except Exception as e:
 # Log whether we have API credentials (without exposing the actual keys)
 print(f"API credentials {'configured' if has_valid_api_credentials() else 'not configured'}")
 
+# Alert rules engine, evaluated against the live market data stream
+alert_engine = AlertEngine()
+alert_metrics = AlertMetricsTracker()
+# Single worker so rule file writes land in the order they were made
+alert_rules_executor = ThreadPoolExecutor(max_workers=1)
+alert_webhook_queue: Optional[asyncio.Queue] = None
+
+try:
+    if ALERT_RULES_FILE.exists():
+        alert_engine.load_rules(ALERT_RULES_FILE)
+        print(f"Loaded {len(alert_engine.rules)} alert rules from {ALERT_RULES_FILE.name}")
+except Exception as e:
+    print(f"Error loading alert rules: {e}")
+
 def fetch_positions_from_exchange():
     """Fetch real position data from exchange using API credentials
     
@@ -260,22 +295,24 @@ def get_shm_path(shm_name):
     return f"{SHM_MOUNT_POINT}/{SHM_DIRECTORY}/{shm_name}"
 
 def read_market_data(instrument=INSTRUMENT):
+    # Try to fetch position data from exchange
+    real_positions = fetch_positions_from_exchange()
+    real_risk_metrics = fetch_account_risk_metrics_from_exchange()
+
+    # If we have real position data, use it instead of mock data
+    if real_positions:
+        global positions
+        positions = real_positions
+
+    # If we have real risk metrics, use them instead of mock data
+    if real_risk_metrics:
+        global risk_metrics
+        risk_metrics = real_risk_metrics
+
+    return read_shm_market_data(instrument)
+
+def read_shm_market_data(instrument=INSTRUMENT):
     try:
-        # Try to fetch position data from exchange
-        real_positions = fetch_positions_from_exchange()
-        real_risk_metrics = fetch_account_risk_metrics_from_exchange()
-        
-        # If we have real position data, use it instead of mock data
-        if real_positions:
-            global positions
-            positions = real_positions
-        
-        # If we have real risk metrics, use them instead of mock data
-        if real_risk_metrics:
-            global risk_metrics
-            risk_metrics = real_risk_metrics
-            
-        # Continue with existing shared memory reading logic...
         shm_name = get_shm_name(instrument)
         shm_path = get_shm_path(shm_name)
         
@@ -295,6 +332,7 @@ def read_market_data(instrument=INSTRUMENT):
             market_depth = MarketDepth(
                 instrument=instrument,
                 timestamp=depth.exchange_ts,
+                local_timestamp=depth.local_ts,
                 bids=[{"price": bid.price, "quantity": bid.quantity} for bid in depth.bids if bid.price > 0],
                 asks=[{"price": ask.price, "quantity": ask.quantity} for ask in depth.asks if ask.price > 0]
             )
@@ -360,6 +398,79 @@ def update_risk_metrics():
     risk_metrics.position_concentration = max_position / total_position_value if total_position_value else 0
     risk_metrics.max_position_size = max_position
 
+def collect_alert_metrics(instrument, depth, now_ms):
+    """Assemble the alert metrics for one instrument from its depth snapshot (or None)"""
+    # Margin ratio is account wide, so it applies to every watched instrument
+    return alert_metrics.update(
+        instrument,
+        depth,
+        now_ms,
+        position=positions.get(instrument),
+        account_margin_ratio=risk_metrics.margin_ratio
+    )
+
+def post_alert_webhook(payload: str):
+    request = urllib.request.Request(
+        ALERT_WEBHOOK_URL,
+        data=payload.encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5):
+            pass
+    except Exception as e:
+        print(f"Error posting alert webhook: {e}")
+
+async def alert_webhook_worker():
+    # Posts one alert at a time so a slow webhook can't pile up blocking calls
+    loop = asyncio.get_running_loop()
+    while True:
+        payload = await alert_webhook_queue.get()
+        await loop.run_in_executor(None, post_alert_webhook, payload)
+        alert_webhook_queue.task_done()
+
+async def dispatch_alert(alert):
+    payload = json.dumps({"type": "alert", "alert": alert.dict()})
+    await manager.broadcast(payload)
+    if ALERT_WEBHOOK_URL and alert_webhook_queue is not None:
+        try:
+            alert_webhook_queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            print(f"Alert webhook queue full, dropping alert for rule {alert.rule_id}")
+
+async def save_alert_rules():
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(alert_rules_executor, write_rules_file, ALERT_RULES_FILE, alert_engine.rules_snapshot())
+
+async def alert_loop():
+    while True:
+        try:
+            # Only instruments referenced by at least one rule are read
+            for instrument in alert_engine.instruments():
+                # Rules may have been removed while an earlier alert was dispatched
+                if instrument not in alert_engine.index:
+                    continue
+
+                now_ms = int(time.time() * 1000)
+                depth, _ = read_shm_market_data(instrument)
+                # Unchanged values are cheap to evaluate and keep debounce timers running
+                metrics = collect_alert_metrics(instrument, depth, now_ms)
+
+                for alert in alert_engine.evaluate(instrument, metrics, now_ms):
+                    await dispatch_alert(alert)
+        except Exception as e:
+            print(f"Error evaluating alert rules: {e}")
+
+        await asyncio.sleep(ALERT_EVAL_INTERVAL)
+
+@app.on_event("startup")
+async def start_alert_loop():
+    global alert_webhook_queue
+    alert_webhook_queue = asyncio.Queue(maxsize=ALERT_WEBHOOK_QUEUE_SIZE)
+    asyncio.create_task(alert_webhook_worker())
+    asyncio.create_task(alert_loop())
+
 @app.get("/")
 async def root():
     return {"message": "Crypto Trading Panel API is running"}
@@ -392,6 +503,45 @@ async def get_position(instrument: str):
 async def get_risk_metrics():
     return risk_metrics
 
+@app.get("/alerts")
+async def get_alerts():
+    return list(alert_engine.history)
+
+@app.get("/alerts/rules")
+async def get_alert_rules():
+    return list(alert_engine.rules.values())
+
+@app.post("/alerts/rules")
+async def add_alert_rules(rules: List[AlertRule]):
+    try:
+        cleared = alert_engine.add_rules(rules)
+    except ValueError as e:
+        return {"error": str(e)}
+    alert_metrics.prune(alert_engine.instruments())
+    for alert in cleared:
+        await dispatch_alert(alert)
+
+    try:
+        await save_alert_rules()
+    except Exception as e:
+        return {"error": f"Alert rules applied but could not be saved: {e}"}
+    return list(alert_engine.rules.values())
+
+@app.delete("/alerts/rules/{rule_id}")
+async def delete_alert_rule(rule_id: str):
+    cleared = alert_engine.remove_rule(rule_id)
+    if cleared is None:
+        return {"error": "Alert rule not found"}
+    alert_metrics.prune(alert_engine.instruments())
+    for alert in cleared:
+        await dispatch_alert(alert)
+
+    try:
+        await save_alert_rules()
+    except Exception as e:
+        return {"error": f"Alert rule removed but could not be saved: {e}"}
+    return {"message": "Alert rule removed"}
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
@@ -0,0 +1,267 @@
+from types import SimpleNamespace
+
+from alerts import AlertEngine, AlertMetricsTracker, AlertRule
+
+
+def make_rule(rule_id="r1", instrument="BTC-USDT", metric="spread", **kwargs):
+    return AlertRule(id=rule_id, instrument=instrument, metric=metric, **kwargs)
+
+
+def run(engine, values, instrument="BTC-USDT", metric="spread", start_ms=0, step_ms=100):
+    """Feed a value trace through the engine and return (value, rule_id, state) events"""
+    events = []
+    for i, value in enumerate(values):
+        for alert in engine.evaluate(instrument, {metric: value}, start_ms + i * step_ms):
+            events.append((value, alert.rule_id, alert.state))
+    return events
+
+
+def test_above_fires_on_crossing_and_not_again_while_active():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(threshold=5.0)])
+
+    assert run(engine, [3.0, 5.0, 6.0, 7.0, 6.0]) == [(6.0, "r1", "triggered")]
+
+
+def test_below_fires_on_crossing_and_clears():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(direction="below", threshold=2.0)])
+
+    assert run(engine, [3.0, 2.0, 1.0, 0.5, 2.5]) == [
+        (1.0, "r1", "triggered"),
+        (2.5, "r1", "cleared"),
+    ]
+
+
+def test_hysteresis_rearms_only_past_clear_level():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(threshold=5.0, hysteresis=1.0)])
+
+    # x == threshold - hysteresis is not yet past the clear level
+    assert run(engine, [3.0, 6.0, 4.5, 4.0, 6.0]) == [(6.0, "r1", "triggered")]
+    assert run(engine, [3.9, 6.0], start_ms=1000) == [
+        (3.9, "r1", "cleared"),
+        (6.0, "r1", "triggered"),
+    ]
+
+
+def test_hysteresis_below_direction():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(direction="below", threshold=2.0, hysteresis=0.5)])
+
+    assert run(engine, [3.0, 1.0, 2.5, 2.6, 1.0]) == [
+        (1.0, "r1", "triggered"),
+        (2.6, "r1", "cleared"),
+        (1.0, "r1", "triggered"),
+    ]
+
+
+def test_debounce_cancelled_when_value_drops_back():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(threshold=5.0, debounce_ms=250)])
+
+    # Condition holds for 200ms only, then drops back to the threshold
+    assert run(engine, [3.0, 6.0, 6.0, 6.0, 5.0, 6.0, 6.0]) == []
+
+
+def test_debounce_fires_once_held():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(threshold=5.0, debounce_ms=250)])
+
+    assert run(engine, [3.0, 6.0, 6.0, 6.0, 7.0, 7.0]) == [(7.0, "r1", "triggered")]
+
+
+def test_rule_added_while_value_already_past_threshold():
+    engine = AlertEngine()
+    engine.add_rules([make_rule("r1", threshold=100.0)])
+    run(engine, [6.0])
+
+    engine.add_rules([make_rule("r2", threshold=5.0)])
+    assert run(engine, [6.0], start_ms=100) == [(6.0, "r2", "triggered")]
+
+
+def test_readding_active_rule_resets_its_state():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(threshold=5.0)])
+    assert run(engine, [3.0, 6.0]) == [(6.0, "r1", "triggered")]
+
+    # Same id with a new threshold is re-armed and re-evaluated against the current value
+    engine.add_rules([make_rule(threshold=5.5)], now_ms=500)
+    assert len(engine.rules) == 1
+    assert run(engine, [6.0], start_ms=1000) == [(6.0, "r1", "triggered")]
+
+    engine.add_rules([make_rule(threshold=8.0)])
+    assert run(engine, [6.0, 9.0], start_ms=2000) == [(9.0, "r1", "triggered")]
+
+
+def test_moving_rule_to_other_instrument_prunes_empty_bucket():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(threshold=5.0)])
+    assert engine.instruments() == ["BTC-USDT"]
+
+    engine.add_rules([make_rule(instrument="ETH-USDT", threshold=5.0)])
+    assert engine.instruments() == ["ETH-USDT"]
+    assert run(engine, [3.0, 6.0]) == []
+    assert run(engine, [3.0, 6.0], instrument="ETH-USDT") == [(6.0, "r1", "triggered")]
+
+
+def test_remove_rule():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(threshold=5.0)])
+
+    assert engine.remove_rule("unknown") is None
+    assert engine.remove_rule("r1") == []
+    assert engine.instruments() == []
+    assert run(engine, [3.0, 6.0]) == []
+
+
+def test_missing_metric_is_skipped():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(metric="volatility", threshold=0.01)])
+
+    assert engine.evaluate("BTC-USDT", {"volatility": None}, 0) == []
+    assert engine.evaluate("BTC-USDT", {"spread": 10.0}, 0) == []
+
+
+def test_replacing_triggered_rule_emits_cleared():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(threshold=5.0)])
+    run(engine, [3.0, 6.0])
+
+    cleared = engine.add_rules([make_rule(threshold=8.0)], now_ms=1000)
+    assert [(a.rule_id, a.state, a.value, a.threshold, a.timestamp) for a in cleared] == [
+        ("r1", "cleared", 6.0, 5.0, 1000)
+    ]
+    assert engine.history[-1] == cleared[0]
+
+    # Replacing a rule that isn't triggered clears nothing
+    assert engine.add_rules([make_rule(threshold=9.0)]) == []
+
+
+def test_removing_triggered_rule_emits_cleared():
+    engine = AlertEngine()
+    engine.add_rules([make_rule(direction="below", threshold=2.0)])
+    run(engine, [3.0, 1.0])
+
+    cleared = engine.remove_rule("r1", now_ms=1000)
+    assert [(a.rule_id, a.state, a.value) for a in cleared] == [("r1", "cleared", 1.0)]
+    assert engine.history[-1] == cleared[0]
+
+
+def make_depth(bid, ask, exchange_ts, local_ts):
+    bids = [{"price": bid, "quantity": 1.0}] if bid else []
+    asks = [{"price": ask, "quantity": 1.0}] if ask else []
+    return SimpleNamespace(timestamp=exchange_ts, local_timestamp=local_ts, bids=bids, asks=asks)
+
+
+def test_tracker_book_metrics_and_staleness_from_local_ts():
+    tracker = AlertMetricsTracker()
+    metrics = tracker.update("BTC-USDT", make_depth(99.0, 101.0, 500, 1000), 1200)
+
+    assert metrics["spread"] == 2.0
+    assert metrics["mid_price"] == 100.0
+    assert metrics["staleness_ms"] == 200
+
+
+def test_tracker_staleness_grows_while_feed_missing():
+    tracker = AlertMetricsTracker()
+    tracker.update("BTC-USDT", make_depth(99.0, 101.0, 500, 1000), 1000)
+
+    metrics = tracker.update("BTC-USDT", None, 6000)
+    assert metrics["staleness_ms"] == 5000
+    assert "spread" not in metrics
+    assert tracker.update("BTC-USDT", None, 9000)["staleness_ms"] == 8000
+
+
+def test_tracker_staleness_counts_from_first_poll_without_data():
+    tracker = AlertMetricsTracker()
+    assert tracker.update("BTC-USDT", None, 1000)["staleness_ms"] == 0
+    assert tracker.update("BTC-USDT", None, 4000)["staleness_ms"] == 3000
+
+
+def test_tracker_only_recomputes_book_when_feed_moves():
+    tracker = AlertMetricsTracker()
+    tracker.update("BTC-USDT", make_depth(99.0, 101.0, 500, 1000), 1000)
+
+    # Same timestamps with different prices is treated as the same snapshot
+    metrics = tracker.update("BTC-USDT", make_depth(90.0, 110.0, 500, 1000), 1200)
+    assert metrics["spread"] == 2.0
+    assert metrics["staleness_ms"] == 200
+
+    metrics = tracker.update("BTC-USDT", make_depth(90.0, 110.0, 600, 1300), 1400)
+    assert metrics["spread"] == 20.0
+    assert metrics["staleness_ms"] == 100
+
+
+def test_tracker_drops_book_metrics_when_side_empty():
+    tracker = AlertMetricsTracker()
+    tracker.update("BTC-USDT", make_depth(99.0, 101.0, 500, 1000), 1000)
+
+    metrics = tracker.update("BTC-USDT", make_depth(99.0, None, 600, 1100), 1100)
+    assert "spread" not in metrics
+    assert "mid_price" not in metrics
+    assert metrics["staleness_ms"] == 0
+
+
+def test_tracker_liquidation_distance_follows_position():
+    tracker = AlertMetricsTracker()
+    depth = make_depth(99.0, 101.0, 500, 1000)
+    position = SimpleNamespace(quantity=1.0, liquidation_price=80.0)
+
+    assert tracker.update("BTC-USDT", depth, 1000, position=position)["liquidation_distance"] == 0.2
+
+    # Liquidation price moves while the book is quiet
+    position.liquidation_price = 90.0
+    assert tracker.update("BTC-USDT", depth, 1200, position=position)["liquidation_distance"] == 0.1
+
+    position.quantity = 0.0
+    assert "liquidation_distance" not in tracker.update("BTC-USDT", depth, 1400, position=position)
+    assert "liquidation_distance" not in tracker.update("BTC-USDT", depth, 1600)
+
+
+def test_tracker_margin_ratio_is_account_level():
+    tracker = AlertMetricsTracker()
+    assert tracker.update("BTC-USDT", None, 1000, account_margin_ratio=0.6)["margin_ratio"] == 0.6
+    assert "margin_ratio" not in tracker.update("BTC-USDT", None, 1200)
+
+
+def test_tracker_volatility_needs_three_samples_in_window():
+    tracker = AlertMetricsTracker(volatility_window_ms=1000)
+    depth = make_depth(99.0, 101.0, 500, 1000)
+
+    assert tracker.update("BTC-USDT", depth, 0)["volatility"] is None
+    assert tracker.update("BTC-USDT", depth, 500)["volatility"] is None
+    # A quiet book sampled on the grid counts as zero returns
+    assert tracker.update("BTC-USDT", depth, 1000)["volatility"] == 0.0
+
+    # The sample at 0 is exactly on the window edge at 1000 and kept, then dropped at 1001
+    assert len(tracker.mid_price_history["BTC-USDT"]) == 3
+    tracker.update("BTC-USDT", None, 1001)
+    assert len(tracker.mid_price_history["BTC-USDT"]) == 2
+
+
+def test_tracker_volatility_scaled_per_square_root_second():
+    tracker = AlertMetricsTracker()
+    prices = [100.0, 101.0, 100.0, 101.0]
+
+    for i, price in enumerate(prices):
+        volatility = tracker.update("BTC-USDT", make_depth(price, price, i, i), i * 250)["volatility"]
+    coarse = volatility
+
+    tracker = AlertMetricsTracker()
+    for i, price in enumerate(prices):
+        volatility = tracker.update("BTC-USDT", make_depth(price, price, i, i), i * 1000)["volatility"]
+
+    # Same moves over four times the interval is half the per-root-second volatility
+    assert abs(coarse - 2 * volatility) < 1e-12
+    assert volatility > 0
+
+
+def test_tracker_prune_drops_unwatched_instruments():
+    tracker = AlertMetricsTracker()
+    tracker.update("BTC-USDT", make_depth(99.0, 101.0, 500, 1000), 1000)
+    tracker.update("ETH-USDT", make_depth(9.0, 11.0, 500, 1000), 1000)
+
+    tracker.prune(["ETH-USDT"])
+    for state in (tracker.feed_timestamps, tracker.feed_local_ts, tracker.book_metrics, tracker.mid_price_history):
+        assert list(state) == ["ETH-USDT"]
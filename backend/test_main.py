@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+
+import main
+from alerts import AlertEngine, AlertMetricsTracker, AlertRule
+
+
+class FakeWebSocket:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    async def send_text(self, message):
+        if self.fail:
+            raise RuntimeError("connection closed")
+        self.sent.append(message)
+
+
+def test_broadcast_drops_dead_connections():
+    manager = main.ConnectionManager()
+    alive, dead = FakeWebSocket(), FakeWebSocket(fail=True)
+    manager.active_connections = [alive, dead]
+
+    asyncio.run(manager.broadcast("hello"))
+    assert alive.sent == ["hello"]
+    assert manager.active_connections == [alive]
+
+    # The connection's own loop may still call disconnect afterwards
+    manager.disconnect(dead)
+    assert manager.active_connections == [alive]
+
+
+def test_margin_ratio_rule_fires_through_metric_assembly(monkeypatch):
+    monkeypatch.setattr(main, "alert_metrics", AlertMetricsTracker())
+    monkeypatch.setattr(main, "risk_metrics", main.RiskMetrics(margin_ratio=0.2))
+    engine = AlertEngine()
+    engine.add_rules([AlertRule(id="margin", instrument="BTC-USDT", metric="margin_ratio", threshold=0.5)])
+
+    metrics = main.collect_alert_metrics("BTC-USDT", None, 1000)
+    assert engine.evaluate("BTC-USDT", metrics, 1000) == []
+
+    main.risk_metrics.margin_ratio = 0.8
+    metrics = main.collect_alert_metrics("BTC-USDT", None, 1200)
+    assert [(a.rule_id, a.state, a.value) for a in engine.evaluate("BTC-USDT", metrics, 1200)] == [
+        ("margin", "triggered", 0.8)
+    ]
+
+
+def test_collect_alert_metrics_uses_current_position(monkeypatch):
+    monkeypatch.setattr(main, "alert_metrics", AlertMetricsTracker())
+    position = main.Position(instrument="BTC-USDT", quantity=1.0, liquidation_price=80.0)
+    monkeypatch.setattr(main, "positions", {"BTC-USDT": position})
+    depth = main.MarketDepth(
+        instrument="BTC-USDT",
+        timestamp=500,
+        local_timestamp=1000,
+        bids=[{"price": 99.0, "quantity": 1.0}],
+        asks=[{"price": 101.0, "quantity": 1.0}]
+    )
+
+    assert main.collect_alert_metrics("BTC-USDT", depth, 1000)["liquidation_distance"] == 0.2
+
+    # The feed breaks, staleness keeps growing and the closed position drops its distance
+    main.positions.clear()
+    metrics = main.collect_alert_metrics("BTC-USDT", None, 4000)
+    assert metrics["staleness_ms"] == 3000
+    assert "liquidation_distance" not in metrics